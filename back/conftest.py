@@ -0,0 +1,4 @@
+import os
+
+# quiz_generator builds a client at import time, tests never reach the API
+os.environ.setdefault("MISTRAL_API_KEY", "test")
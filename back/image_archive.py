@@ -0,0 +1,167 @@
+import os
+import time
+import queue
+import base64
+import hashlib
+import tempfile
+import threading
+from typing import Optional, TypedDict
+
+ARCHIVE_DIR = os.path.join(tempfile.gettempdir(), "quiz_images")
+# Retention limits for the archive folder, overridable from the environment
+ARCHIVE_MAX_BYTES = int(os.getenv("QUIZ_IMAGES_MAX_BYTES", str(200 * 1024 * 1024)))
+ARCHIVE_MAX_AGE_SECONDS = int(os.getenv("QUIZ_IMAGES_MAX_AGE_SECONDS", str(24 * 60 * 60)))
+ARCHIVE_QUEUE_SIZE = int(os.getenv("QUIZ_IMAGES_QUEUE_SIZE", "64"))
+
+
+class ArchiveStats(TypedDict):
+    directory: str
+    files: int
+    total_bytes: int
+    oldest_age_seconds: Optional[float]
+    newest_age_seconds: Optional[float]
+    max_bytes: int
+    max_age_seconds: int
+
+
+def content_filename(image_data: bytes) -> str:
+    """Name an archived image after the SHA-256 of its content"""
+    return f"{hashlib.sha256(image_data).hexdigest()}.jpg"
+
+
+def archived_files(directory: str = ARCHIVE_DIR) -> list[os.DirEntry]:
+    """Archived images in the folder, partial writes (*.part) left out"""
+    if not os.path.isdir(directory):
+        return []
+    return [
+        entry for entry in os.scandir(directory)
+        if entry.is_file() and not entry.name.endswith(".part")
+    ]
+
+
+def usage_stats(directory: str = ARCHIVE_DIR) -> ArchiveStats:
+    """Collect file count, total size and age range of the archive folder"""
+    now = time.time()
+    total_bytes = 0
+    mtimes = []
+    for entry in archived_files(directory):
+        stat = entry.stat()
+        total_bytes += stat.st_size
+        mtimes.append(stat.st_mtime)
+    return ArchiveStats(
+        directory=directory,
+        files=len(mtimes),
+        total_bytes=total_bytes,
+        oldest_age_seconds=now - min(mtimes) if mtimes else None,
+        newest_age_seconds=now - max(mtimes) if mtimes else None,
+        max_bytes=ARCHIVE_MAX_BYTES,
+        max_age_seconds=ARCHIVE_MAX_AGE_SECONDS,
+    )
+
+
+class ImageArchiver(object):
+    """
+    Writes uploaded images to the archive folder on a background thread.
+
+    Uploads are put on a bounded queue so the request path never touches the
+    disk. When the queue is full the image is dropped rather than blocking the
+    caller. After each write, files older than `max_age_seconds` are removed and
+    the oldest remaining files are evicted until the folder fits in `max_bytes`.
+    """
+    directory: str
+    max_bytes: int
+    max_age_seconds: int
+
+    def __init__(self,
+                 directory: str = ARCHIVE_DIR,
+                 max_bytes: int = ARCHIVE_MAX_BYTES,
+                 max_age_seconds: int = ARCHIVE_MAX_AGE_SECONDS,
+                 queue_size: int = ARCHIVE_QUEUE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, base64_doc: str, session_id: int) -> bool:
+        """
+        Queue a base64 image for archiving without blocking.
+
+        Returns:
+            bool: False if the queue is full and the image was dropped
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((base64_doc, session_id))
+            return True
+        except queue.Full:
+            print(f"⚠️  Archive queue full, dropping image for session {session_id}")
+            return False
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="image-archiver", daemon=True
+                )
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            base64_doc, session_id = self._queue.get()
+            try:
+                self._write(base64_doc, session_id)
+                self._enforce_retention()
+            except Exception as e:
+                print(f"❌ Failed to archive image for session {session_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, base64_doc: str, session_id: int) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Remove data URL prefix if present
+        clean_base64 = base64_doc
+        if "," in base64_doc:
+            clean_base64 = base64_doc.split(",")[1]
+        image_data = base64.b64decode(clean_base64)
+
+        filepath = os.path.join(self.directory, content_filename(image_data))
+        if os.path.exists(filepath):
+            # Same content already archived, refresh its age instead of rewriting
+            os.utime(filepath)
+        else:
+            tmp_path = f"{filepath}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(image_data)
+            os.replace(tmp_path, filepath)
+        print(f"✅ Archived image for session {session_id} to: {filepath}")
+        return filepath
+
+    def _enforce_retention(self):
+        now = time.time()
+        files = []
+        for entry in archived_files(self.directory):
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age_seconds:
+                self._remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+archiver = ImageArchiver()
@@ -0,0 +1,139 @@
+import os
+import time
+import uuid
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, TypedDict
+from sessions import Session
+
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "4"))
+# Finished jobs are forgotten after this many seconds
+INGEST_JOB_RETENTION_SECONDS = int(os.getenv("INGEST_JOB_RETENTION_SECONDS", "3600"))
+
+
+class PageStatus(TypedDict):
+    index: int
+    # "pending", "processing", "done", "duplicate" or "failed"
+    status: str
+    text: Optional[str]
+    error: Optional[str]
+
+
+class IngestJob(object):
+    """Progress of one document upload, page by page"""
+    id: str
+    session_id: int
+    pages: list[PageStatus]
+    created_at: float
+    finished_at: Optional[float]
+
+    def __init__(self, session_id: int, page_count: int):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.pages = [
+            PageStatus(index=i, status="pending", text=None, error=None)
+            for i in range(page_count)
+        ]
+        self.created_at = time.time()
+        self.finished_at = None
+        # Bumped on every page update, lets event streams wait for the next change
+        self.version = 0
+        self._changed = threading.Condition()
+
+    @property
+    def status(self) -> str:
+        statuses = [page["status"] for page in self.pages]
+        if any(status in ("pending", "processing") for status in statuses):
+            return "running"
+        if statuses and all(status == "failed" for status in statuses):
+            return "failed"
+        return "done"
+
+    def update_page(self, index: int, status: str, text: Optional[str] = None, error: Optional[str] = None):
+        with self._changed:
+            self.pages[index] = PageStatus(index=index, status=status, text=text, error=error)
+            if self.status != "running" and self.finished_at is None:
+                self.finished_at = time.time()
+            self.version += 1
+            self._changed.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._changed:
+            return {
+                "job_id": self.id,
+                "session_id": self.session_id,
+                "status": self.status,
+                "pages": [dict(page) for page in self.pages],
+                "version": self.version,
+            }
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """Block until the job moves past `version` (or timeout), return the current version"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version, timeout)
+            return self.version
+
+    def events(self, heartbeat_seconds: float = 15) -> Iterator[Optional[dict]]:
+        """
+        Yield a snapshot on every change until the job finishes, and None after
+        `heartbeat_seconds` without a change so the stream can send a keep-alive
+        """
+        version = -1
+        while True:
+            snapshot = self.snapshot()
+            if snapshot["version"] != version:
+                version = snapshot["version"]
+                yield snapshot
+            if snapshot["status"] != "running":
+                return
+            if self.wait_for_change(version, heartbeat_seconds) == version:
+                yield None
+
+
+class IngestJobManager(object):
+    """Runs document ingestion on a worker pool, one task per page"""
+
+    def __init__(self, max_workers: int = INGEST_MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session: Session, base64_docs: list[str]) -> IngestJob:
+        """Reserve the pages in the session and start ingesting them in the background"""
+        job = IngestJob(session.id, len(base64_docs))
+        slots = session.reserve_pages(base64_docs)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+
+        print(f"📸 Received {len(base64_docs)} images for session {session.id}, ingest job {job.id}")
+        for index, (slot, base64_doc) in enumerate(zip(slots, base64_docs)):
+            # Carry the request context over, so a profiled upload also times its pages
+            context = contextvars.copy_context()
+            self._executor.submit(context.run, self._ingest_page, job, session, index, slot, base64_doc)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _ingest_page(self, job: IngestJob, session: Session, index: int, slot: int, base64_doc: str):
+        job.update_page(index, "processing")
+        try:
+            decoded_doc = session.ingest_page(slot, base64_doc)
+        except Exception as e:
+            print(f"❌ Failed to ingest image {index + 1} of job {job.id}: {str(e)}")
+            job.update_page(index, "failed", error=str(e))
+            return
+        if decoded_doc is None:
+            job.update_page(index, "duplicate")
+        else:
+            print(f"📄 Processed image {index + 1}/{len(job.pages)}: {len(decoded_doc)} characters extracted")
+            job.update_page(index, "done", text=decoded_doc)
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > INGEST_JOB_RETENTION_SECONDS:
+                del self._jobs[job_id]
@@ -1,11 +1,19 @@
-from typing import Union, List, Dict
-from fastapi import FastAPI, HTTPException
+from typing import Union, List, Dict, Optional
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import os
+import json
+import hmac
 from dotenv import load_dotenv
 from quiz_generator import QuizGenerator
-from sessions import Session, NUMBER_GENERATED_QUESTION
+from sessions import Session
+import tts
+import profiling
+from ingest_jobs import IngestJobManager
+from study_sets import StudySetRegistry
 
 # Load environment variables
 load_dotenv()
@@ -26,6 +34,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in request profiling, see /admin/profiles
+app.add_middleware(profiling.ProfilingMiddleware)
+
 # Initialize quiz generator
 try:
     api_key = os.getenv("MISTRAL_API_KEY")
@@ -38,7 +49,12 @@ except Exception as e:
     print(f"Error initializing quiz generator: {e}")
     quiz_generator = None
 
+# Initialize speech synthesis
+speech_synthesizer = tts.create_synthesizer()
+
 sessions: dict[int, Session] = {}
+ingest_jobs = IngestJobManager()
+study_sets = StudySetRegistry()
 
 @app.get("/", response_model=Dict[str, str])
 def read_root():
@@ -60,32 +76,160 @@ def health_check():
         message="Quiz Generator API is running"
     )
 
+class SessionRequest(BaseModel):
+    study_set_id: Optional[str] = None
 class SessionResponse(BaseModel):
     session_id: int
 @app.post("/session", response_model=SessionResponse)
-def session():
+def session(request: Optional[SessionRequest] = None):
     """
     Creates a new session for the user, answers with the id
+
+    With a study_set_id, the session uses that shared study set instead of
+    its own uploaded documents.
     """
-    new_session = Session(quiz_generator)
+    new_session = Session(quiz_generator, speech_synthesizer)
+    if request is not None and request.study_set_id is not None:
+        study_set = study_sets.acquire(request.study_set_id)
+        if study_set is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Study set with id {request.study_set_id} not found"
+            )
+        new_session.attach_study_set(study_set)
     sessions[new_session.id] = new_session
     return SessionResponse(session_id=new_session.id)
 
+@app.delete("/session/{id}", response_model=SessionResponse)
+def delete_session(id: int):
+    """
+    Ends a session, releasing its study set if it has one
+    """
+    if id not in sessions:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Session with id {id} not found"
+        )
+    session = sessions.pop(id)
+    if session.study_set is not None:
+        study_sets.release(session.study_set)
+    return SessionResponse(session_id=id)
+
+def validate_base64_docs(base64_docs: list[str]):
+    """Reject empty uploads and documents that do not look like base64"""
+    # Validate that we have documents to add
+    if not base64_docs:
+        raise HTTPException(
+            status_code=400,
+            detail="No documents provided. base64_docs cannot be empty."
+        )
+
+    # Validate base64 format (basic validation)
+    with profiling.span("validate_base64_docs"):
+        for i, doc in enumerate(base64_docs):
+            if not doc or not isinstance(doc, str):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Document at index {i} is invalid. Must be a non-empty string."
+                )
+
+            # Basic base64 validation - check if it looks like base64
+            if not doc.replace('+', '').replace('/', '').replace('=', '').isalnum():
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Document at index {i} does not appear to be valid base64 encoded data."
+                )
+
+class StudySetRequest(BaseModel):
+    base64_docs: list[str]
+class StudySetResponse(BaseModel):
+    study_set_id: str
+    status: str
+    pages: int
+    questions: int
+    references: int
+    # Only returned on creation, needed to release the creator's reference
+    release_token: Optional[str] = None
+@app.post("/study-set", response_model=StudySetResponse, status_code=202)
+def create_study_set(request: StudySetRequest):
+    """
+    Ingest a document set once so that many sessions can share it
+
+    Uploading the same images again returns the existing study set. Each
+    call holds its own reference until DELETE /study-set/{study_set_id} with
+    the returned release_token in the X-Release-Token header.
+    """
+    validate_base64_docs(request.base64_docs)
+    study_set, release_token = study_sets.create(quiz_generator, speech_synthesizer, request.base64_docs)
+    return study_set_response(study_set, release_token)
+
+def study_set_response(study_set, release_token: Optional[str] = None) -> StudySetResponse:
+    return StudySetResponse(
+        study_set_id=study_set.id,
+        status=study_set.status,
+        pages=len(study_set.pages) if study_set.status == "ready" else study_set.page_count,
+        questions=len(study_set.questions),
+        references=study_set.refcount,
+        release_token=release_token
+    )
+
+@app.get("/study-set/{study_set_id}", response_model=StudySetResponse)
+def get_study_set(study_set_id: str):
+    """
+    get the ingestion status of a study set
+    """
+    study_set = study_sets.get(study_set_id)
+    if study_set is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Study set with id {study_set_id} not found"
+        )
+    return study_set_response(study_set)
+
+@app.delete("/study-set/{study_set_id}", response_model=StudySetResponse)
+def delete_study_set(study_set_id: str, x_release_token: Optional[str] = Header(default=None)):
+    """
+    release the creator's reference on a study set, it is freed once no session uses it
+    """
+    study_set = study_sets.get(study_set_id)
+    if study_set is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Study set with id {study_set_id} not found"
+        )
+    if x_release_token is None or not study_sets.release_creator(study_set, x_release_token):
+        raise HTTPException(
+            status_code=403,
+            detail="Invalid or already used release token"
+        )
+    return study_set_response(study_set)
+
 class SessionDocRequest(BaseModel):
     base64_docs: list[str]
+class IngestPageStatus(BaseModel):
+    index: int
+    status: str
+    text: Optional[str] = None
+    error: Optional[str] = None
 class SessionDocResponse(BaseModel):
     success: bool
-@app.post("/session/{id}/doc", response_model=SessionDocResponse)
+    job_id: str
+    status: str
+    pages: list[IngestPageStatus]
+@app.post("/session/{id}/doc", response_model=SessionDocResponse, status_code=202)
 def add_session_doc(id: int, request: SessionDocRequest, response_model=SessionDocResponse):
     """
     Add base64 encoded images to an existing session
 
+    The images are ingested (archived and OCRed) in the background. Follow the
+    progress with GET /session/{id}/doc/jobs/{job_id} or its /events stream.
+
     Args:
         id: Session ID
         request: SessionDocRequest containing list of base64 encoded documents
 
     Returns:
-        SessionDocResponse indicating success or failure
+        SessionDocResponse with the ingest job id and the status of each page
     """
     # Check if session exists
     if id not in sessions:
@@ -94,34 +238,20 @@ def add_session_doc(id: int, request: SessionDocRequest, response_model=SessionD
             detail=f"Session with id {id} not found"
         )
 
-    # Validate that we have documents to add
-    if not request.base64_docs:
+    session = sessions[id]
+    if session.study_set is not None:
         raise HTTPException(
-            status_code=400,
-            detail="No documents provided. base64_docs cannot be empty."
+            status_code=409,
+            detail=f"Session {id} uses study set {session.study_set.id}, documents cannot be added to it"
         )
 
-    # Validate base64 format (basic validation)
-    for i, doc in enumerate(request.base64_docs):
-        if not doc or not isinstance(doc, str):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Document at index {i} is invalid. Must be a non-empty string."
-            )
-
-        # Basic base64 validation - check if it looks like base64
-        if not doc.replace('+', '').replace('/', '').replace('=', '').isalnum():
-            raise HTTPException(
-                status_code=400,
-                detail=f"Document at index {i} does not appear to be valid base64 encoded data."
-            )
+    validate_base64_docs(request.base64_docs)
 
     try:
-        # Add documents to the session
-        session = sessions[id]
-        session.add_docs(request.base64_docs)
+        # Start ingesting the documents in the background
+        job = ingest_jobs.submit(session, request.base64_docs)
 
-        return SessionDocResponse(success=True)
+        return ingest_job_response(job.snapshot())
 
     except Exception as e:
         raise HTTPException(
@@ -129,6 +259,49 @@ def add_session_doc(id: int, request: SessionDocRequest, response_model=SessionD
             detail=f"Error adding documents to session: {str(e)}"
         )
 
+def ingest_job_response(snapshot: dict) -> SessionDocResponse:
+    return SessionDocResponse(
+        success=snapshot["status"] != "failed",
+        job_id=snapshot["job_id"],
+        status=snapshot["status"],
+        pages=[IngestPageStatus(**page) for page in snapshot["pages"]]
+    )
+
+@app.get("/session/{id}/doc/jobs/{job_id}", response_model=SessionDocResponse)
+def get_session_doc_job(id: int, job_id: str):
+    """
+    get the progress of a document upload, with the text of the pages ready so far
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None or job.session_id != id:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Ingest job {job_id} not found for session {id}"
+        )
+    return ingest_job_response(job.snapshot())
+
+@app.get("/session/{id}/doc/jobs/{job_id}/events")
+def get_session_doc_job_events(id: int, job_id: str):
+    """
+    server-sent events stream of a document upload, one event per page update
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None or job.session_id != id:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Ingest job {job_id} not found for session {id}"
+        )
+
+    def event_stream():
+        for snapshot in job.events():
+            if snapshot is None:
+                # Comment line, keeps proxies from closing the stream during a long page
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {ingest_job_response(snapshot).model_dump_json()}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 class SessionQuestionResponse(BaseModel):
     question: str
     total: int
@@ -145,11 +318,19 @@ def get_session_question(id: int):
             detail=f"Session with id {id} not found"
         )
     session = sessions[id]
+    try:
+        return next_question_response(session)
+    except ValueError as e:
+        # Study set still ingesting or failed, or the upload is not ready yet
+        raise HTTPException(status_code=409, detail=str(e))
+
+def next_question_response(session: Session) -> SessionQuestionResponse:
     question = session.generate_next_question()
-    current = NUMBER_GENERATED_QUESTION - len(session.questions_to_ask) + 1
+    # Pages ready later add their own questions, so the total can grow within a round
+    current = session.question_total - len(session.questions_to_ask) + 1
     return SessionQuestionResponse(
         question=question,
-        total=NUMBER_GENERATED_QUESTION,
+        total=session.question_total,
         current=current
     )
 
@@ -168,7 +349,11 @@ def post_session_answer(id: int, request: SessionAnswerRequest):
             detail=f"Session with id {id} not found"
         )
     session = sessions[id]
-    return SessionAnswerResponse(response=session.generate_feedback(request.user_answer))
+    try:
+        feedback = session.generate_feedback(request.user_answer)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return SessionAnswerResponse(response=feedback)
 
 class SessionFollowupQuestionResponse(BaseModel):
     question: str
@@ -186,6 +371,9 @@ def get_session_followup_question(id: int):
             detail=f"Session with id {id} not found"
         )
     session = sessions[id]
+    return next_followup_question_response(session)
+
+def next_followup_question_response(session: Session) -> SessionFollowupQuestionResponse:
     question = session.generate_next_followup_question()
     # Calculate indexing for follow-up questions (they generate 5 at a time)
     total_followup = 5
@@ -196,6 +384,216 @@ def get_session_followup_question(id: int):
         current=current_followup
     )
 
+@app.get("/session/{id}/question/audio")
+def get_session_question_audio(id: int, voice: Optional[str] = None):
+    """
+    stream the spoken version of the current question
+    """
+    if id not in sessions:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Session with id {id} not found"
+        )
+    if speech_synthesizer is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Speech synthesis is not configured"
+        )
+    session = sessions[id]
+    try:
+        text = session.current_question_text()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return StreamingResponse(
+        speech_synthesizer.stream(text, voice),
+        media_type=speech_synthesizer.media_type
+    )
+
+@app.get("/session/{id}/feedback/audio")
+def get_session_feedback_audio(id: int, voice: Optional[str] = None):
+    """
+    stream the spoken version of the feedback to the latest answer
+    """
+    if id not in sessions:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Session with id {id} not found"
+        )
+    if speech_synthesizer is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Speech synthesis is not configured"
+        )
+    session = sessions[id]
+    try:
+        text = session.last_feedback()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return StreamingResponse(
+        speech_synthesizer.stream(text, voice),
+        media_type=speech_synthesizer.media_type
+    )
+
+@app.websocket("/session/{id}/ws")
+async def session_conversation(websocket: WebSocket, id: int):
+    """
+    Persistent conversation channel for a session
+
+    Client messages:
+        {"type": "question"}                        -> next question
+        {"type": "followup"}                        -> next follow-up question
+        {"type": "answer", "user_answer": "..."}    -> feedback, then next question
+
+    Server messages:
+        {"type": "question" | "followup", "question": ..., "total": ..., "current": ...}
+        {"type": "feedback_token", "token": ...}    streamed while feedback is generated
+        {"type": "feedback", "response": ...}       complete feedback
+        {"type": "done"}                            no question left after an answer
+        {"type": "error", "detail": ...}
+    """
+    if id not in sessions:
+        await websocket.close(code=4404, reason=f"Session with id {id} not found")
+        return
+    session = sessions[id]
+    await websocket.accept()
+
+    async def send_question(kind: str):
+        if kind == "followup":
+            response = await run_in_threadpool(next_followup_question_response, session)
+        else:
+            response = await run_in_threadpool(next_question_response, session)
+        await websocket.send_json({"type": kind, **response.model_dump()})
+
+    try:
+        while True:
+            raw_message = await websocket.receive_text()
+            try:
+                message = json.loads(raw_message)
+            except ValueError:
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects."})
+                continue
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects."})
+                continue
+
+            kind = message.get("type")
+            try:
+                if kind in ("question", "followup"):
+                    await send_question(kind)
+                elif kind == "answer":
+                    tokens = []
+                    async for token in iterate_in_threadpool(session.stream_feedback(str(message.get("user_answer", "")))):
+                        tokens.append(token)
+                        await websocket.send_json({"type": "feedback_token", "token": token})
+                    await websocket.send_json({"type": "feedback", "response": "".join(tokens)})
+
+                    # Push the next already generated question in the same turn
+                    if session.followup_questions_to_ask:
+                        await send_question("followup")
+                    elif session.questions_to_ask:
+                        await send_question("question")
+                    else:
+                        await websocket.send_json({"type": "done"})
+                else:
+                    await websocket.send_json({"type": "error", "detail": f"Unknown message type: {kind}"})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # A failed turn (bad input or upstream error) keeps the conversation open
+                await websocket.send_json({"type": "error", "detail": str(e)})
+    except WebSocketDisconnect:
+        pass
+
+class SessionReportResponse(BaseModel):
+    report: str
+    correct: int
+    answered: int
+    weak_topics: list[str]
+    stale: bool
+
+@app.get("/session/{id}/report", response_model=SessionReportResponse)
+def get_session_report(id: int, final: bool = False):
+    """
+    get the performance report of the quiz
+
+    Returns the running summary maintained after each answer right away.
+    With final=true, a polish pass is run first if the summary is behind.
+    """
+    if id not in sessions:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Session with id {id} not found"
+        )
+    session = sessions[id]
+    report = session.current_report()
+    if final and report["stale"]:
+        # The polish pass also tallies the answers the running summary missed
+        report = session.generate_report()
+    return SessionReportResponse(
+        report=report["summary"],
+        correct=report["correct"],
+        answered=report["answered"],
+        weak_topics=report["weak_topics"],
+        stale=report["stale"]
+    )
+
+def check_admin_token(token: Optional[str]):
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(
+            status_code=403,
+            detail="Admin routes are disabled, set ADMIN_TOKEN to enable them"
+        )
+    if token is None or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(
+            status_code=403,
+            detail="Invalid admin token"
+        )
+
+@app.get("/admin/profiles")
+def list_profiles(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    list the latest profiled requests, newest first
+    """
+    check_admin_token(x_admin_token)
+    return profiling.recent_profiles()
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(default=None)):
+    """
+    span timings of a profiled request
+    """
+    check_admin_token(x_admin_token)
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Profile {profile_id} not found"
+        )
+    return profile.details()
+
+@app.get("/admin/profiles/{profile_id}/flamegraph", response_class=PlainTextResponse)
+def get_profile_flamegraph(profile_id: str, x_admin_token: Optional[str] = Header(default=None)):
+    """
+    stack samples of a profiled request in collapsed format (flamegraph.pl, speedscope)
+    """
+    check_admin_token(x_admin_token)
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Profile {profile_id} not found"
+        )
+    return profile.collapsed()
+
+@app.get("/admin/routing")
+def get_model_routing(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    model routes, latency objectives and measured latencies per operation and model
+    """
+    check_admin_token(x_admin_token)
+    return quiz_generator.router.describe()
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -3,8 +3,10 @@ import base64
 from mistralai import Mistral
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from profiling import traced
 load_dotenv()
 
+@traced
 def process_image_to_text(base64_image: str) -> str:
     """
     Process a base64 encoded image and extract text using Mistral OCR.
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+
+LARGE_MODEL = "mistral-large-latest"
+SMALL_MODEL = "mistral-small-latest"
+
+
+@dataclass
+class ModelRoute:
+    model: str
+    temperature: float = 0.7
+    max_tokens: int = 1000
+    # Any other chat parameter, passed as is (e.g. top_p)
+    extra: dict = field(default_factory=dict)
+
+    def params(self) -> dict:
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            **self.extra,
+        }
+
+
+# Candidate models per QuizGenerator operation, preferred first. Only the first
+# candidate is used unless adaptive routing is on.
+DEFAULT_ROUTES: dict[str, list[ModelRoute]] = {
+    "questions": [ModelRoute(LARGE_MODEL, 0.7, 10000)],
+    "follow_ups": [ModelRoute(LARGE_MODEL, 0.7, 1000)],
+    "feedback": [ModelRoute(SMALL_MODEL, 0.7, 500), ModelRoute("ministral-8b-latest", 0.7, 500)],
+    "summary": [ModelRoute(LARGE_MODEL, 0.3, 300)],
+    "report": [ModelRoute(LARGE_MODEL, 0.7, 300)],
+    "page_summary": [ModelRoute(LARGE_MODEL, 0.2, 800)],
+    "digest": [ModelRoute(LARGE_MODEL, 0.2, 2000)],
+}
+
+# Latency objectives (seconds) for the operations on the student's critical path
+DEFAULT_SLOS: dict[str, float] = {
+    "feedback": 1.5,
+}
+
+
+class ModelRouter(object):
+    """
+    Picks the model for each QuizGenerator operation.
+
+    With adaptive routing, the router keeps an exponentially weighted moving
+    average of the latency of every (operation, model) pair and returns the first
+    candidate whose average is within the operation's SLO, or the fastest one if
+    none is. Failed calls are recorded as SLO misses. A measurement older than
+    `probe_interval` seconds counts as unknown, so a model that was slow gets
+    tried again later.
+    """
+    routes: dict[str, list[ModelRoute]]
+    slos: dict[str, float]
+    adaptive: bool
+
+    def __init__(self,
+                 routes: Optional[dict[str, list[ModelRoute]]] = None,
+                 slos: Optional[dict[str, float]] = None,
+                 adaptive: bool = False,
+                 smoothing: float = 0.2,
+                 probe_interval: float = 300.0):
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        self.slos = {**DEFAULT_SLOS, **(slos or {})}
+        self.adaptive = adaptive
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval
+        # (operation, model) -> (average latency in seconds, time of last measurement)
+        self._latencies: dict[tuple[str, str], tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def route(self, operation: str) -> ModelRoute:
+        candidates = self.routes[operation]
+        slo = self.slos.get(operation)
+        if not self.adaptive or slo is None or len(candidates) == 1:
+            return candidates[0]
+
+        now = time.monotonic()
+        measured = []
+        with self._lock:
+            for candidate in candidates:
+                entry = self._latencies.get((operation, candidate.model))
+                if entry is None or now - entry[1] > self.probe_interval:
+                    return candidate
+                if entry[0] <= slo:
+                    return candidate
+                measured.append((entry[0], candidate))
+        return min(measured, key=lambda m: m[0])[1]
+
+    def record(self, operation: str, model: str, seconds: float, failed: bool = False):
+        """
+        Fold a call's latency into the average. A failed or timed out call counts
+        as an SLO miss (at least twice the SLO), so a failing model is avoided
+        like a slow one instead of staying unmeasured.
+        """
+        if failed:
+            slo = self.slos.get(operation)
+            if slo is not None:
+                seconds = max(seconds, 2 * slo)
+        with self._lock:
+            entry = self._latencies.get((operation, model))
+            if entry is None or time.monotonic() - entry[1] > self.probe_interval:
+                average = seconds
+            else:
+                average = (1 - self.smoothing) * entry[0] + self.smoothing * seconds
+            self._latencies[(operation, model)] = (average, time.monotonic())
+
+    def latencies(self) -> dict[str, dict[str, float]]:
+        """Current average latency in seconds per operation and model"""
+        with self._lock:
+            result: dict[str, dict[str, float]] = {}
+            for (operation, model), (average, _) in self._latencies.items():
+                result.setdefault(operation, {})[model] = average
+            return result
+
+    def describe(self) -> dict:
+        return {
+            "adaptive": self.adaptive,
+            "routes": {op: [asdict(c) for c in candidates] for op, candidates in self.routes.items()},
+            "slos": self.slos,
+            "latencies": self.latencies(),
+        }
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """
+        Build a router from the environment:
+            QUIZ_MODEL_ROUTES: JSON {operation: [{"model": ..., "temperature": ..., "max_tokens": ...}, ...]}
+            QUIZ_MODEL_SLOS: JSON {operation: seconds}
+            QUIZ_ADAPTIVE_ROUTING: "1" to choose models from measured latency
+        """
+        routes = {
+            operation: [ModelRoute(**candidate) for candidate in candidates]
+            for operation, candidates in json.loads(os.getenv("QUIZ_MODEL_ROUTES", "{}")).items()
+        }
+        slos = json.loads(os.getenv("QUIZ_MODEL_SLOS", "{}"))
+        adaptive = os.getenv("QUIZ_ADAPTIVE_ROUTING", "0").lower() in ("1", "true", "yes")
+        return cls(routes=routes, slos=slos, adaptive=adaptive)
@@ -0,0 +1,161 @@
+import io
+import os
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from PIL import Image
+
+# Two pages are near-duplicates when both their dHash and pHash differ by at most
+# this many of 64 bits. Text pages sharing a layout have close thumbnails (distinct
+# pages measured down to 6 bits apart, see test_page_hash.py), so the default only
+# catches re-uploads that barely changed: a missed duplicate costs one OCR call,
+# a false one drops a real page.
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "4"))
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("PAGE_HASH_CACHE_SIZE", "10000"))
+
+HASH_SIZE = 8
+PHASH_IMAGE_SIZE = 32
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so dct(x) = D @ x @ D.T for an n x n block"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_DCT = _dct_matrix(PHASH_IMAGE_SIZE)
+
+
+def _grayscale(image: Image.Image, width: int, height: int) -> np.ndarray:
+    return np.asarray(
+        image.convert("L").resize((width, height), Image.Resampling.LANCZOS),
+        dtype=np.float32,
+    )
+
+
+def _pack(bits: np.ndarray) -> np.uint64:
+    return np.frombuffer(np.packbits(bits.ravel()).tobytes(), dtype=">u8")[0].astype(np.uint64)
+
+
+def dhash(image: Image.Image) -> np.uint64:
+    """Difference hash: sign of the horizontal gradient on a 9x8 thumbnail"""
+    pixels = _grayscale(image, HASH_SIZE + 1, HASH_SIZE)
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: Image.Image) -> np.uint64:
+    """Perceptual hash: low frequency DCT coefficients above their median"""
+    pixels = _grayscale(image, PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    # The DC term only reflects overall brightness, keep it out of the median
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+def _decode(base64_doc: str) -> bytes:
+    # Remove data URL prefix if present
+    if "," in base64_doc:
+        base64_doc = base64_doc.split(",")[1]
+    return base64.b64decode(base64_doc)
+
+
+def content_key(base64_doc: str) -> str:
+    """SHA-256 of the decoded image bytes"""
+    return hashlib.sha256(_decode(base64_doc)).hexdigest()
+
+
+def image_hash(base64_doc: str) -> Optional[np.ndarray]:
+    """
+    Compute the [dHash, pHash] pair of a base64 encoded image.
+
+    Returns:
+        Optional[np.ndarray]: Two uint64 values, or None if the image cannot be decoded
+    """
+    try:
+        image = Image.open(io.BytesIO(_decode(base64_doc)))
+        image.load()
+    except Exception as e:
+        print(f"⚠️  Could not hash image: {str(e)}")
+        return None
+    return np.array([dhash(image), phash(image)], dtype=np.uint64)
+
+
+def hamming_distances(hashes: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """Bit distance between every row of `hashes` (n, 2) and `target` (2,), as (n, 2)"""
+    xor = np.bitwise_xor(hashes, target)
+    bits = np.unpackbits(xor.view(np.uint8).reshape(len(hashes), 2, 8), axis=-1)
+    return bits.sum(axis=-1)
+
+
+def near_duplicates(hashes: np.ndarray, target: np.ndarray, max_distance: int) -> np.ndarray:
+    """Indices of the rows of `hashes` within `max_distance` bits of `target` on both hashes"""
+    if len(hashes) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero((hamming_distances(hashes, target) <= max_distance).all(axis=1))
+
+
+class PageHashIndex(object):
+    """
+    Perceptual hashes of OCRed pages with their text, searched for near-duplicates
+    """
+    max_distance: int
+
+    def __init__(self, max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._hashes = np.empty((0, 2), dtype=np.uint64)
+        self._texts: list[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def find(self, page_hash: np.ndarray) -> Optional[str]:
+        """Text of the closest near-duplicate page, or None"""
+        with self._lock:
+            matches = near_duplicates(self._hashes, page_hash, self.max_distance)
+            if matches.size == 0:
+                return None
+            distances = hamming_distances(self._hashes[matches], page_hash)
+            best = matches[np.argmin(distances.sum(axis=1))]
+            return self._texts[best]
+
+    def add(self, page_hash: np.ndarray, text: str):
+        with self._lock:
+            self._hashes = np.vstack([self._hashes, page_hash[None, :]])
+            self._texts.append(text)
+
+
+class PageTextCache(object):
+    """
+    OCR text by exact image content (content_key), least recently used evicted
+    first. Only byte-identical images match, so a page never gets the text of a
+    look-alike page uploaded by someone else.
+    """
+    max_entries: int
+
+    def __init__(self, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._texts.get(key)
+            if text is not None:
+                self._texts.move_to_end(key)
+            return text
+
+    def add(self, key: str, text: str):
+        with self._lock:
+            self._texts[key] = text
+            self._texts.move_to_end(key)
+            while len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+
+
+# Pages OCRed by any session, so identical re-uploads in other sessions skip OCR too
+shared_cache = PageTextCache()
@@ -0,0 +1,247 @@
+import os
+import sys
+import hmac
+import time
+import uuid
+import random
+import threading
+import functools
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, TypedDict
+
+# Fraction of requests profiled without the header, 0 disables sampling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_RETENTION = int(os.getenv("PROFILE_RETENTION", "50"))
+# A request carrying this header set to the admin token is profiled
+PROFILE_HEADER = b"x-profile"
+
+
+class Span(TypedDict):
+    name: str
+    start_ms: float
+    duration_ms: float
+    thread: str
+
+
+class RequestProfile(object):
+    """Spans and stack samples collected while handling one request"""
+    id: str
+    method: str
+    path: str
+    spans: list[Span]
+    samples: Counter
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.duration_ms: Optional[float] = None
+        self.spans = []
+        self.samples = Counter()
+        # Threads currently working on the request, with their number of open spans
+        self.thread_ids: Counter = Counter()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float):
+        with self._lock:
+            self.spans.append(Span(
+                name=name,
+                start_ms=(start - self._start) * 1000,
+                duration_ms=(end - start) * 1000,
+                thread=threading.current_thread().name,
+            ))
+
+    def enter_thread(self):
+        with self._lock:
+            self.thread_ids[threading.get_ident()] += 1
+
+    def exit_thread(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.thread_ids[thread_id] -= 1
+            if self.thread_ids[thread_id] <= 0:
+                del self.thread_ids[thread_id]
+
+    def threads(self) -> set[int]:
+        with self._lock:
+            return set(self.thread_ids)
+
+    def add_sample(self, stack: str):
+        with self._lock:
+            self.samples[stack] += 1
+
+    def collapsed(self) -> str:
+        """Samples in collapsed stack format, the input of flamegraph.pl and speedscope"""
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "method": self.method,
+                "path": self.path,
+                "started_at": self.started_at,
+                "duration_ms": self.duration_ms,
+                "span_count": len(self.spans),
+                "sample_count": sum(self.samples.values()),
+            }
+
+    def details(self) -> dict:
+        summary = self.summary()
+        with self._lock:
+            summary["spans"] = sorted(self.spans, key=lambda span: span["start_ms"])
+        return summary
+
+
+_current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+_active: set[RequestProfile] = set()
+_finished: deque = deque(maxlen=PROFILE_RETENTION)
+_lock = threading.Lock()
+_sampler: Optional[threading.Thread] = None
+
+
+def _format_stack(frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def _sample_loop():
+    """Sample the stacks of the threads working on profiled requests until none is left"""
+    global _sampler
+    own_id = threading.get_ident()
+    while True:
+        with _lock:
+            if not _active:
+                _sampler = None
+                return
+            targets = [(profile, profile.threads()) for profile in _active]
+        frames = sys._current_frames()
+        for profile, thread_ids in targets:
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != own_id:
+                    profile.add_sample(_format_stack(frame))
+        del frames
+        time.sleep(PROFILE_INTERVAL_SECONDS)
+
+
+def start_profile(method: str, path: str) -> tuple[RequestProfile, contextvars.Token]:
+    global _sampler
+    profile = RequestProfile(method, path)
+    token = _current_profile.set(profile)
+    with _lock:
+        _active.add(profile)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="profile-sampler", daemon=True)
+            _sampler.start()
+    return profile, token
+
+
+def finish_profile(profile: RequestProfile, token: contextvars.Token):
+    _current_profile.reset(token)
+    profile.duration_ms = (time.perf_counter() - profile._start) * 1000
+    with _lock:
+        _active.discard(profile)
+        _finished.append(profile)
+
+
+def recent_profiles() -> list[dict]:
+    with _lock:
+        profiles = list(_finished)
+    return [profile.summary() for profile in reversed(profiles)]
+
+
+def get_profile(profile_id: str) -> Optional[RequestProfile]:
+    with _lock:
+        for profile in _finished:
+            if profile.id == profile_id:
+                return profile
+    return None
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a block as part of the current request profile, no-op when not profiling"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    # Threads are sampled only while they run a span of the request: the event loop
+    # and pool threads also serve other requests the rest of the time
+    profile.enter_thread()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start, time.perf_counter())
+        profile.exit_thread()
+
+
+def traced(func: Callable) -> Callable:
+    """Record every call of `func` as a span named after it while the request is profiled"""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_profile.get() is None:
+            return func(*args, **kwargs)
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _should_profile(scope: dict) -> bool:
+    # Profiles expose stacks and timings, only admins may ask for one
+    admin_token = os.getenv("ADMIN_TOKEN")
+    for key, value in scope["headers"]:
+        if key == PROFILE_HEADER and admin_token and hmac.compare_digest(value, admin_token.encode()):
+            return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class ProfilingMiddleware(object):
+    """
+    ASGI middleware profiling the requests sent with an X-Profile header holding
+    the admin token (ADMIN_TOKEN), or a PROFILE_SAMPLE_RATE fraction of all
+    requests. Profiled responses carry an X-Profile-Id header. Other requests
+    only pay for the header check.
+
+    Stack samples only cover the code running inside span() or @traced blocks,
+    on whichever thread runs them. The event loop thread is not sampled for the
+    whole request, since it also serves every other request meanwhile.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile, token = start_profile(scope["method"], scope["path"])
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            finish_profile(profile, token)
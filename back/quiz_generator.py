@@ -1,8 +1,11 @@
 import os
-from typing import List, Tuple
+import time
+from typing import Iterator, List, Optional, Tuple
 from mistralai import Mistral
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from model_routing import ModelRouter
+from profiling import span, traced
 
 load_dotenv()
 
@@ -10,12 +13,59 @@ class QuestionsAnswers(BaseModel):
     questions: list[str]
     answers: list[str]
 
+class RunningSummary(BaseModel):
+    summary: str
+    correct: bool
+    weak_topics: list[str]
+
+class PolishedReport(BaseModel):
+    report: str
+    correct: int
+    weak_topics: list[str]
+
 
 class QuizGenerator:
-    def __init__(self, api_key: str):
-        """Initialize the QuizGenerator with Mistral API key."""
+    def __init__(self, api_key: str, router: Optional[ModelRouter] = None):
+        """Initialize the QuizGenerator with Mistral API key and the model routing table."""
         self.client = Mistral(api_key=api_key)
-
+        self.router = router if router is not None else ModelRouter.from_env()
+
+    def _complete(self, operation: str, **kwargs):
+        return self._routed(operation, self.client.chat.complete, **kwargs)
+
+    def _parse(self, operation: str, **kwargs):
+        return self._routed(operation, self.client.chat.parse, **kwargs)
+
+    def _routed(self, operation: str, call, **kwargs):
+        """Run a chat call with the model and parameters routed for `operation`, recording its latency"""
+        route = self.router.route(operation)
+        start = time.perf_counter()
+        failed = True
+        try:
+            with span(f"upstream.{operation}"):
+                response = call(**route.params(), **kwargs)
+            failed = False
+        finally:
+            self.router.record(operation, route.model, time.perf_counter() - start, failed=failed)
+        return response
+
+    def _stream(self, operation: str, **kwargs):
+        """Streaming chat call; the latency recorded is the time to the first chunk"""
+        route = self.router.route(operation)
+        start = time.perf_counter()
+        first_chunk = True
+        try:
+            for chunk in self.client.chat.stream(**route.params(), **kwargs):
+                if first_chunk:
+                    self.router.record(operation, route.model, time.perf_counter() - start)
+                    first_chunk = False
+                yield chunk
+        except Exception:
+            if first_chunk:
+                self.router.record(operation, route.model, time.perf_counter() - start, failed=True)
+            raise
+
+    @traced
     def generate_feedback(self, markdown_text: str, question: str, right_answer: str, user_answer: str) -> str:
         """
         Generate feedback for a user's answer by comparing it with the correct answer.
@@ -29,6 +79,37 @@ class QuizGenerator:
         Returns:
             str: Brief feedback about the user's answer
         """
+        chat_response = self._complete(
+            "feedback",
+            messages=self._feedback_messages(markdown_text, question, right_answer, user_answer)
+        )
+
+        return chat_response.choices[0].message.content
+
+    def stream_feedback(self, markdown_text: str, question: str, right_answer: str, user_answer: str) -> Iterator[str]:
+        """
+        Same as generate_feedback, but yields the feedback token by token as the model produces it.
+
+        Args:
+            markdown_text (str): The original text the question was based on
+            question (str): The question that was asked
+            right_answer (str): The correct answer
+            user_answer (str): The user's submitted answer
+
+        Yields:
+            str: Partial feedback text
+        """
+        stream_response = self._stream(
+            "feedback",
+            messages=self._feedback_messages(markdown_text, question, right_answer, user_answer)
+        )
+
+        for chunk in stream_response:
+            content = chunk.data.choices[0].delta.content
+            if isinstance(content, str) and content:
+                yield content
+
+    def _feedback_messages(self, markdown_text: str, question: str, right_answer: str, user_answer: str) -> list[dict]:
         prompt = f"""Give a one-sentence personalized feedback on the answer. Use "you" and "your" to make it more personal.
         If the answer is correct, start with encouraging phrases like "Well done!", "Great job!", or "Let's go!" before giving the feedback.
         If the answer is incorrect or incomplete, start with encouraging phrases like "No worries!", "Keep going!", or "You're getting there!" before explaining what was wrong.
@@ -44,20 +125,12 @@ class QuizGenerator:
 
         Keep it to one sentence and make it encouraging. If the answer is wrong, include the correct answer:"""
 
-        messages = [
+        return [
             {"role": "system", "content": "You are a supportive teacher providing personalized, encouraging feedback on answers. Always include the correct answer when the user's answer is wrong."},
             {"role": "user", "content": prompt}
         ]
 
-        chat_response = self.client.chat.complete(
-            model="mistral-large-latest",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
-        )
-
-        return chat_response.choices[0].message.content
-
+    @traced
     def generate_follow_up_questions(self,
                                     markdown_text: str,
                                     previous_questions: List[str],
@@ -110,12 +183,10 @@ class QuizGenerator:
             {"role": "user", "content": prompt}
         ]
 
-        chat_response = self.client.chat.parse(
-            model="mistral-large-latest",
+        chat_response = self._parse(
+            "follow_ups",
             messages=messages,
-            response_format=QuestionsAnswers,
-            temperature=0.7,
-            max_tokens=1000
+            response_format=QuestionsAnswers
         )
         print("chat anwer", chat_response)
 
@@ -125,45 +196,195 @@ class QuizGenerator:
 
         return questions_list[:num_follow_ups], answers_list[:num_follow_ups]
 
-    def generate_report(self, questions: List[str], answers: List[str], feedback: List[str]) -> str:
+    @traced
+    def update_summary(self,
+                       summary: str,
+                       question: str,
+                       right_answer: str,
+                       user_answer: str,
+                       feedback: str) -> RunningSummary:
+        """
+        Fold one answered question into the running performance summary.
+
+        Args:
+            summary (str): The running summary so far (empty for the first answer)
+            question (str): The question that was asked
+            right_answer (str): The correct answer
+            user_answer (str): The user's submitted answer
+            feedback (str): The feedback given for the answer
+
+        Returns:
+            RunningSummary: The updated summary, whether the answer was correct and
+            the topics the user struggled with in this answer
+        """
+        prompt = f"""Update the running summary of a student's quiz performance with the latest answered question.
+        Keep the summary short (at most 5 sentences), focused on strengths and on the topics the student struggles with.
+        Decide whether the latest answer is correct and list the topics the student got wrong in it (empty if correct).
+
+        Running summary:
+        {summary or "(no questions answered yet)"}
+
+        Latest question: {question}
+        Correct answer: {right_answer}
+        Student answer: {user_answer}
+        Feedback: {feedback}
+
+        Format the output as:
+        {{
+            summary: updated summary,
+            correct: true or false,
+            weak_topics: [topic1, topic2, ...]
+        }}"""
+
+        messages = [
+            {"role": "system", "content": "You are an educational AI that keeps a concise running record of a student's quiz performance."},
+            {"role": "user", "content": prompt}
+        ]
+
+        chat_response = self._parse(
+            "summary",
+            messages=messages,
+            response_format=RunningSummary
+        )
+
+        return chat_response.choices[0].message.parsed
+
+    @traced
+    def generate_report(self,
+                        questions: List[str],
+                        answers: List[str],
+                        feedback: List[str],
+                        summary: str = "",
+                        markdown_text: str = "") -> PolishedReport:
         """
         Generate a concise report about the user's performance on the quiz.
 
         Args:
-            markdown_text (str): The original text the questions were based on
             questions (List[str]): List of questions asked
             answers (List[str]): List of user's answers
             feedback (List[str]): List of feedback given for each answer
+            summary (str): Running summary already covering earlier answers, so only
+                the answers it does not cover need to be passed
+            markdown_text (str): The text the questions were based on
 
         Returns:
-            str: A concise report summarizing the user's performance and areas for improvement
+            PolishedReport: A concise report summarizing the user's performance and areas for
+            improvement, with how many of the given answers are correct and the topics the
+            user struggled with in them
         """
-        prompt = f"""Based on the following questions, answers, and feedback, generate a concise report that:
+        qa_context = "\n".join([
+            f"Q: {q}\nA: {a}\nFeedback: {f}"
+            for q, a, f in zip(questions, answers, feedback)
+        ])
+
+        prompt = f"""Based on the following running summary, questions, answers, and feedback, generate a concise report that:
         1. Summarizes the user's overall performance
         2. Identifies 2-3 specific areas where the user needs improvement
         3. Provides brief, actionable suggestions for improvement
 
         Keep the report short and focused on actionable insights.
 
+        Original text:
+        {markdown_text or "(not provided)"}
+
+        Running summary of earlier answers:
+        {summary or "(none)"}
+
         Questions and Answers:
-        {chr(10).join([f"Q: {q}\nA: {a}\nFeedback: {f}" for q, a, f in zip(questions, answers, feedback)])}
+        {qa_context}
 
-        Generate a concise report:"""
+        Also count how many of the answers listed under "Questions and Answers" are correct and list
+        the topics the user got wrong in them (empty if all are correct).
+
+        Format the output as:
+        {{
+            report: concise report,
+            correct: number of correct answers,
+            weak_topics: [topic1, topic2, ...]
+        }}"""
 
         messages = [
             {"role": "system", "content": "You are an educational AI that generates concise, actionable performance reports."},
             {"role": "user", "content": prompt}
         ]
 
-        chat_response = self.client.chat.complete(
-            model="mistral-large-latest",
+        chat_response = self._parse(
+            "report",
             messages=messages,
-            temperature=0.7,
-            max_tokens=300
+            response_format=PolishedReport
+        )
+
+        return chat_response.choices[0].message.parsed
+
+    @traced
+    def summarize_page(self, page_text: str, page_number: int) -> str:
+        """
+        Summarize a single page of study material, keeping what a quiz could ask about.
+
+        Args:
+            page_text (str): The OCR text of the page
+            page_number (int): Position of the page in the upload
+
+        Returns:
+            str: Compact summary of the page
+        """
+        prompt = f"""Summarize page {page_number} of a student's study material.
+        Keep every definition, key fact, date, formula and relationship between concepts a quiz could ask about.
+        Drop repetitions, layout artifacts and filler. Use short bullet points.
+
+        Page {page_number}:
+        {page_text}
+
+        Summary:"""
+
+        messages = [
+            {"role": "system", "content": "You are a teacher assistant that condenses study material without losing testable facts."},
+            {"role": "user", "content": prompt}
+        ]
+
+        chat_response = self._complete(
+            "page_summary",
+            messages=messages
+        )
+
+        return chat_response.choices[0].message.content
+
+    @traced
+    def merge_page_summaries(self, summaries: List[str]) -> str:
+        """
+        Merge page summaries into a single study digest.
+
+        Args:
+            summaries (List[str]): Summary of each page, in page order
+
+        Returns:
+            str: Study digest covering all pages
+        """
+        pages_context = "\n\n".join([
+            f"Page {i + 1}:\n{summary}" for i, summary in enumerate(summaries)
+        ])
+
+        prompt = f"""Merge the following page summaries of a student's study material into one compact study digest.
+        Group related content by topic, remove duplicates across pages and keep every testable fact.
+
+        Page summaries:
+        {pages_context}
+
+        Study digest:"""
+
+        messages = [
+            {"role": "system", "content": "You are a teacher assistant that condenses study material without losing testable facts."},
+            {"role": "user", "content": prompt}
+        ]
+
+        chat_response = self._complete(
+            "digest",
+            messages=messages
         )
 
         return chat_response.choices[0].message.content
 
+    @traced
     def generate_questions(self, markdown_text: str, num_questions: int = 4) -> List[Tuple[str, str]]:
         """
         Generate questions and answers from markdown text using Mistral AI.
@@ -206,12 +427,10 @@ class QuizGenerator:
         ]
 
 
-        chat_response = self.client.chat.parse(
-            model="mistral-large-latest",
+        chat_response = self._parse(
+            "questions",
             messages=messages,
-            response_format=QuestionsAnswers,
-            temperature=0.7,
-            max_tokens=10000
+            response_format=QuestionsAnswers
         )
 
         parsed_response = chat_response.choices[0].message.parsed
@@ -1,14 +1,30 @@
+import os
 import random
-import base64
+import threading
+import numpy as np
 import mistral_ocr
-import os
-import tempfile
-from datetime import datetime
-from typing import TypedDict, Optional
+import image_archive
+import page_hash
+import study_digest
+from profiling import traced
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, TypedDict, Optional, TYPE_CHECKING
 from dataclasses import dataclass
 from quiz_generator import QuizGenerator
+from tts import SpeechSynthesizer
+
+if TYPE_CHECKING:
+    from study_sets import StudySet
 
 NUMBER_GENERATED_QUESTION = 4
+# How long question generation waits for an upload still being ingested
+PAGE_WAIT_TIMEOUT_SECONDS = 120
+# Generate the first questions as soon as one page is ready instead of waiting for
+# the whole upload, the later pages get their own questions once they are ready
+EARLY_QUESTION_START = os.getenv("EARLY_QUESTION_START", "0").lower() in ("1", "true", "yes")
+
+# Shared pool running the background report summary updates of all sessions
+SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="report-summary")
 
 class Question(TypedDict):
     question: str
@@ -20,80 +36,212 @@ class AnsweredQuestion(TypedDict):
     user_answer: str
     feedback: str
 
+class SessionReport(TypedDict):
+    summary: str
+    correct: int
+    answered: int
+    weak_topics: list[str]
+    stale: bool
+
 class Session(object):
     generator: QuizGenerator
+    synthesizer: Optional[SpeechSynthesizer]
+    study_set: Optional["StudySet"]
     id: int
     base64_docs: list[str]
     decoded_docs: list[str]
     concatenated_docs: str
     questions_to_ask: list[Question]
+    question_total: int
     answers_with_feedbacks: list[AnsweredQuestion]
+    report_summary: str
+    correct_count: int
+    summarized_count: int
+    weak_topics: list[str]
 
-    def __init__(self, generator: QuizGenerator):
+    def __init__(self, generator: QuizGenerator, synthesizer: Optional[SpeechSynthesizer] = None):
         self.generator = generator
+        self.synthesizer = synthesizer
+        self.study_set = None
+        self._study_set_loaded = False
         self.id = random.randint(0, 1000000000)
         self.base64_docs = []
         self.decoded_docs = []
         self.concatenated_docs = ""
+        self._context_page_count = 0
         self.questions_to_ask = []
+        # Questions queued since the queue was last empty, answered ones included
+        self.question_total = 0
         self.followup_questions_to_ask = []
         self.answers_with_feedbacks = []
-
+        # Running report, updated in the background after each feedback
+        self.report_summary = ""
+        self.correct_count = 0
+        self.summarized_count = 0
+        self.weak_topics = []
+        self._summary_lock = threading.Lock()
+        self._summary_running = False
+        self._final_report: Optional[SessionReport] = None
+        self.page_index = page_hash.PageHashIndex()
+        # Text of every uploaded page in upload order, None while it is being ingested
+        # and "" when it was skipped, decoded_docs holds the ready ones
+        self._page_slots: list[Optional[str]] = []
+        self._pages_ready = threading.Condition()
+        # Hashes of the pages being OCRed, near-duplicates wait for them instead of OCRing again
+        self._hashes_in_flight: list[np.ndarray] = []
+        # Slots of the pages questions were already generated from
+        self._quizzed_slots: set[int] = set()
+
+    @traced
     def add_doc(self, base64_doc: str):
         """Add a single base64 encoded document to the session"""
-        self.base64_docs.append(base64_doc)
+        [slot] = self.reserve_pages([base64_doc])
         # Decode the base64 document
-        decoded_doc = mistral_ocr.process_image_to_text(base64_doc)
-        self.decoded_docs.append(decoded_doc)
-
-    def _save_image_to_temp(self, base64_doc: str, index: int) -> str:
-        """Save a base64 image to temporary folder for testing purposes"""
+        self.ingest_page(slot, base64_doc)
+
+    def attach_study_set(self, study_set: "StudySet"):
+        """
+        Use a shared study set as this session's documents and question bank.
+        The session then only stores its own answers and feedback.
+        """
+        if self._page_slots or self.questions_to_ask or self.answers_with_feedbacks:
+            raise ValueError("A study set can only be attached to a session before any document or question.")
+        self.study_set = study_set
+
+    def _load_study_set(self):
+        """Point the session at the study set's pages, context and question bank without copying them"""
+        self.study_set.wait_ready()
+        self.decoded_docs = self.study_set.pages
+        self.concatenated_docs = self.study_set.context
+        self._context_page_count = len(self.study_set.pages)
+        self.questions_to_ask = list(self.study_set.questions)
+        self.question_total = len(self.questions_to_ask)
+        self._study_set_loaded = True
+
+    def reserve_pages(self, base64_docs: list[str]) -> list[int]:
+        """Register pages about to be ingested, keeping their upload order, and return their slots"""
+        if self.study_set is not None:
+            raise ValueError("Documents cannot be added to a session attached to a study set.")
+        with self._pages_ready:
+            self.base64_docs.extend(base64_docs)
+            start = len(self._page_slots)
+            self._page_slots.extend([None] * len(base64_docs))
+            return list(range(start, len(self._page_slots)))
+
+    @traced
+    def ingest_page(self, slot: int, base64_doc: str) -> Optional[str]:
+        """
+        Archive and OCR one reserved page. Safe to call for several pages in parallel.
+
+        Returns:
+            Optional[str]: The page text, or None if the page duplicates one of this session
+        """
+        # Archive image in the background for testing
+        self._save_image_to_temp(base64_doc)
+        decoded_doc = None
         try:
-            # Create temp directory if it doesn't exist
-            temp_dir = os.path.join(tempfile.gettempdir(), "quiz_images")
-            os.makedirs(temp_dir, exist_ok=True)
-
-            # Remove data URL prefix if present
-            clean_base64 = base64_doc
-            if "," in base64_doc:
-                clean_base64 = base64_doc.split(",")[1]
-
-            # Decode base64 to binary
-            image_data = base64.b64decode(clean_base64)
-
-            # Create filename with timestamp and session info
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"session_{self.id}_{timestamp}_image_{index}.jpg"
-            filepath = os.path.join(temp_dir, filename)
+            decoded_doc = self._extract_text(base64_doc)
+        finally:
+            # A failed page is left out instead of blocking the others
+            self._fill_page_slot(slot, decoded_doc or "")
+        return decoded_doc
+
+    def _fill_page_slot(self, slot: int, text: str):
+        with self._pages_ready:
+            self._page_slots[slot] = text
+            self.decoded_docs = [page for page in self._page_slots if page]
+            self._pages_ready.notify_all()
 
-            # Save the image
-            with open(filepath, "wb") as f:
-                f.write(image_data)
-
-            print(f"✅ Saved image to: {filepath}")
-            return filepath
+    @property
+    def pending_pages(self) -> int:
+        return sum(1 for page in self._page_slots if page is None)
+
+    def wait_for_pages(self, timeout: float = PAGE_WAIT_TIMEOUT_SECONDS, first_page: bool = False) -> bool:
+        """Wait until nothing is left to ingest, or only until one page is ready with `first_page`"""
+        with self._pages_ready:
+            return self._pages_ready.wait_for(
+                lambda: self.pending_pages == 0 or (first_page and bool(self.decoded_docs)), timeout
+            )
 
-        except Exception as e:
-            print(f"❌ Failed to save image {index}: {str(e)}")
-            return ""
+    def _take_unquizzed_pages(self) -> list[str]:
+        """Text of the ready pages no question was generated from yet, marked as quizzed"""
+        with self._pages_ready:
+            slots = [i for i, page in enumerate(self._page_slots) if page and i not in self._quizzed_slots]
+            self._quizzed_slots.update(slots)
+            return [self._page_slots[i] for i in slots]
+
+    @traced
+    def _extract_text(self, base64_doc: str) -> Optional[str]:
+        """
+        OCR a page, skipping OCR for pages seen before.
+
+        Returns:
+            Optional[str]: The page text, reused from the shared cache when another
+            session already OCRed the exact same image, or None when the page
+            near-duplicates one of this session and must not be added again
+        """
+        image_hash = page_hash.image_hash(base64_doc)
+        if image_hash is None:
+            return mistral_ocr.process_image_to_text(base64_doc)
+
+        if not self._claim_page_hash(image_hash):
+            print(f"♻️  Page already uploaded in session {self.id}, skipping it")
+            return None
+        try:
+            content_key = page_hash.content_key(base64_doc)
+            shared_text = page_hash.shared_cache.get(content_key)
+            if shared_text is not None:
+                print(f"♻️  Same page found in shared cache, skipping OCR")
+                self.page_index.add(image_hash, shared_text)
+                return shared_text
 
+            decoded_doc = mistral_ocr.process_image_to_text(base64_doc)
+            self.page_index.add(image_hash, decoded_doc)
+            page_hash.shared_cache.add(content_key, decoded_doc)
+            return decoded_doc
+        finally:
+            with self._pages_ready:
+                self._hashes_in_flight = [h for h in self._hashes_in_flight if h is not image_hash]
+                self._pages_ready.notify_all()
+
+    def _claim_page_hash(self, image_hash: np.ndarray) -> bool:
+        """
+        Reserve a page for OCR, False if it duplicates a page of this session.
+        A near-duplicate of a page still being OCRed waits for it: skipped once
+        that page is done, OCRed itself if that page failed.
+        """
+        with self._pages_ready:
+            while True:
+                if self.page_index.find(image_hash) is not None:
+                    return False
+                in_flight = page_hash.near_duplicates(
+                    np.array(self._hashes_in_flight, dtype=np.uint64).reshape(-1, 2),
+                    image_hash, self.page_index.max_distance
+                )
+                if in_flight.size == 0:
+                    self._hashes_in_flight.append(image_hash)
+                    return True
+                self._pages_ready.wait()
+
+    @traced
+    def _save_image_to_temp(self, base64_doc: str) -> bool:
+        """Queue a base64 image for archiving in the temporary folder for testing purposes"""
+        return image_archive.archiver.submit(base64_doc, self.id)
+
+    @traced
     def add_docs(self, base64_docs: list[str]):
         """Add multiple base64 encoded documents to the session"""
-        self.base64_docs.extend(base64_docs)
+        slots = self.reserve_pages(base64_docs)
 
         print(f"📸 Received {len(base64_docs)} images for session {self.id}")
 
         # Print temp directory location for easy access
-        temp_dir = os.path.join(tempfile.gettempdir(), "quiz_images")
-        print(f"🗂️  Images will be saved to: {temp_dir}")
+        print(f"🗂️  Images will be saved to: {image_archive.archiver.directory}")
 
-        for i, base64_doc in enumerate(base64_docs):
-            # Save image to temp folder for testing
-            saved_path = self._save_image_to_temp(base64_doc, i)
-
-            # Process with OCR
-            decoded_doc = mistral_ocr.process_image_to_text(base64_doc)
-            self.decoded_docs.append(decoded_doc)
+        for i, (slot, base64_doc) in enumerate(zip(slots, base64_docs)):
+            decoded_doc = self.ingest_page(slot, base64_doc)
+            if decoded_doc is None:
+                continue
 
             print(
                 f"📄 Processed image {i + 1}/{len(base64_docs)}: {len(decoded_doc)} characters extracted"
@@ -103,27 +251,50 @@ class Session(object):
             f"✨ Completed processing {len(base64_docs)} images for session {self.id}"
         )
 
+    @traced
+    def _refresh_context(self):
+        """Rebuild the prompt context (raw pages or study digest) when pages were added"""
+        if self._context_page_count == len(self.decoded_docs):
+            return
+        self.concatenated_docs = study_digest.study_context(self.generator, self.decoded_docs)
+        self._context_page_count = len(self.decoded_docs)
+
+    @traced
     def generate_next_question(self) -> str:
+        if self.study_set is not None and not self._study_set_loaded:
+            self._load_study_set()
+
         if self.questions_to_ask:
+            # Pages that became ready since the last questions get questions of their own
+            new_pages = self._take_unquizzed_pages()
+            if new_pages:
+                # Feedback and the report grade against the session context, keep the new pages in it
+                self._refresh_context()
+                self._add_questions(study_digest.study_context(self.generator, new_pages))
             return self.questions_to_ask[0]["question"]
 
-        if not self.concatenated_docs:
-            self.concatenated_docs = ""
-            for i, doc in enumerate(self.decoded_docs):
-                self.concatenated_docs += f"""
-Page {i + 1}:
-{doc}
+        if not self.wait_for_pages(first_page=EARLY_QUESTION_START) and not self.decoded_docs:
+            raise ValueError("The uploaded pages are still being processed. Please try again.")
+        self._take_unquizzed_pages()
+        self._refresh_context()
+        self.question_total = 0
+        self._add_questions(self.concatenated_docs)
 
-"""
+        return self.questions_to_ask[0]["question"]
+
+    def _add_questions(self, context: str):
         questions_list, answers_list = self.generator.generate_questions(
-            self.concatenated_docs, NUMBER_GENERATED_QUESTION
+            context, NUMBER_GENERATED_QUESTION
         )
+        new_questions: list[Question] = []
         for question, answer in zip(questions_list, answers_list):
             typedQuestion: Question = {"question": question, "right_answer": answer}
-            self.questions_to_ask.append(typedQuestion)
-
-        return self.questions_to_ask[0]["question"]
+            new_questions.append(typedQuestion)
+        self.questions_to_ask.extend(new_questions)
+        self.question_total += len(new_questions)
+        self._presynthesize(new_questions)
 
+    @traced
     def generate_next_followup_question(self) -> str:
         if self.followup_questions_to_ask:
             return self.followup_questions_to_ask[0]["question"]
@@ -132,14 +303,7 @@ Page {i + 1}:
         if not self.answers_with_feedbacks:
             raise ValueError("Cannot generate follow-up questions without any answered questions. Please answer at least one question first.")
 
-        if not self.concatenated_docs:
-            self.concatenated_docs = ""
-            for (i, doc) in enumerate(self.decoded_docs):
-                self.concatenated_docs += f"""
-Page {i+1}:
-{doc}
-
-"""
+        self._refresh_context()
 
         # Generate follow-up questions based on previous Q&A and feedback
         questions_list, answers_list = self.generator.generate_follow_up_questions(
@@ -163,45 +327,163 @@ Page {i+1}:
 
         if not self.followup_questions_to_ask:
             raise ValueError("No follow-up questions were generated. Please try again.")
+        self._presynthesize(self.followup_questions_to_ask)
 
         return self.followup_questions_to_ask[0]["question"]
 
+    def _presynthesize(self, questions: list[Question]):
+        """Synthesize question audio in the background before the student asks for it"""
+        if self.synthesizer is not None:
+            self.synthesizer.presynthesize([q["question"] for q in questions])
+
+    def current_question_text(self) -> str:
+        """Text of the question waiting for an answer"""
+        return self._current_question()["question"]
+
+    def last_feedback(self) -> str:
+        """Feedback given to the latest answer"""
+        if not self.answers_with_feedbacks:
+            raise ValueError("No answer has been given yet.")
+        return self.answers_with_feedbacks[-1]["feedback"]
+
+    @traced
     def generate_feedback(self, user_answer):
+        current_question = self._current_question()
+        feedback = self.generator.generate_feedback(self.concatenated_docs, current_question["question"], current_question["right_answer"], user_answer)
+        return self._record_feedback(user_answer, feedback)
+
+    def stream_feedback(self, user_answer) -> Iterator[str]:
+        """Same as generate_feedback, but yields the feedback as it is generated"""
+        current_question = self._current_question()
+        tokens = []
+        for token in self.generator.stream_feedback(self.concatenated_docs, current_question["question"], current_question["right_answer"], user_answer):
+            tokens.append(token)
+            yield token
+        self._record_feedback(user_answer, "".join(tokens))
+
+    def _current_question(self) -> Question:
         # Check if we're answering a follow-up question or regular question
         if self.followup_questions_to_ask:
-            current_question = self.followup_questions_to_ask[0]
-            feedback = self.generator.generate_feedback(self.concatenated_docs, current_question["question"], current_question["right_answer"], user_answer)
-            answered_question: AnsweredQuestion = {
-                "feedback": feedback,
-                "question": current_question["question"],
-                "right_answer": current_question["right_answer"],
-                "user_answer": user_answer
-            }
-            self.answers_with_feedbacks.append(answered_question)
-            self.followup_questions_to_ask.pop(0)
-            return answered_question["feedback"]
+            return self.followup_questions_to_ask[0]
+        if not self.questions_to_ask:
+            raise ValueError("There is no pending question to answer. Please ask for a question first.")
+        return self.questions_to_ask[0]
+
+    def _record_feedback(self, user_answer: str, feedback: str) -> str:
+        if self.followup_questions_to_ask:
+            pending_questions = self.followup_questions_to_ask
         else:
-            current_question = self.questions_to_ask[0]
-            feedback = self.generator.generate_feedback(self.concatenated_docs, current_question["question"], current_question["right_answer"], user_answer)
-            answered_question: AnsweredQuestion = {
-                "feedback": feedback,
-                "question": current_question["question"],
-                "right_answer": current_question["right_answer"],
-                "user_answer": user_answer
-            }
-            self.answers_with_feedbacks.append(answered_question)
-            self.questions_to_ask.pop(0)
-            return answered_question["feedback"]
+            pending_questions = self.questions_to_ask
+        current_question = pending_questions[0]
+        answered_question: AnsweredQuestion = {
+            "feedback": feedback,
+            "question": current_question["question"],
+            "right_answer": current_question["right_answer"],
+            "user_answer": user_answer
+        }
+        self.answers_with_feedbacks.append(answered_question)
+        pending_questions.pop(0)
+        if self.synthesizer is not None:
+            # Start the audio now, the client asks for it right after the text
+            self.synthesizer.presynthesize([feedback])
+        self._schedule_summary_update()
+        return answered_question["feedback"]
+
+    def _schedule_summary_update(self):
+        """Start a background summary update unless one is already running"""
+        with self._summary_lock:
+            if self._summary_running:
+                # The running update picks up the new answer before it stops
+                return
+            self._summary_running = True
+        SUMMARY_EXECUTOR.submit(self._update_summary)
+
+    def _update_summary(self):
+        """Fold every answer not yet in the running summary into it, oldest first"""
+        while True:
+            with self._summary_lock:
+                if self.summarized_count >= len(self.answers_with_feedbacks):
+                    self._summary_running = False
+                    return
+                answered = self.answers_with_feedbacks[self.summarized_count]
+                summary = self.report_summary
+
+            try:
+                result = self.generator.update_summary(
+                    summary,
+                    answered["question"],
+                    answered["right_answer"],
+                    answered["user_answer"],
+                    answered["feedback"],
+                )
+            except Exception as e:
+                # Leave the answer unsummarized, the final report will cover it
+                print(f"❌ Failed to update report summary for session {self.id}: {str(e)}")
+                with self._summary_lock:
+                    self._summary_running = False
+                return
+
+            with self._summary_lock:
+                self.report_summary = result.summary
+                self.correct_count += int(result.correct)
+                for topic in result.weak_topics:
+                    if topic not in self.weak_topics:
+                        self.weak_topics.append(topic)
+                self.summarized_count += 1
 
     @property
     def previous_answers(self) -> list[str]:
         """Extract user answers from answered questions"""
         return [answer["user_answer"] for answer in self.answers_with_feedbacks]
 
-    def generate_report(self) -> str:
-        return self.generator.generate_report(
-            self.concatenated_docs,
-            [q["question"] for q in self.questions_to_ask],
-            self.previous_answers,
-            [a["feedback"] for a in self.answers_with_feedbacks],
+    def current_report(self) -> SessionReport:
+        """Return the latest running summary without calling the generator"""
+        with self._summary_lock:
+            answered = len(self.answers_with_feedbacks)
+            return SessionReport(
+                summary=self.report_summary,
+                correct=self.correct_count,
+                answered=answered,
+                weak_topics=list(self.weak_topics),
+                stale=self.summarized_count < answered,
+            )
+
+    @traced
+    def generate_report(self) -> SessionReport:
+        """
+        Final report for the session. The running summary is returned as is when it
+        covers every answer, otherwise a polish pass folds in the missing answers,
+        tally and weak topics included.
+        """
+        with self._summary_lock:
+            answered = len(self.answers_with_feedbacks)
+            if self._final_report is not None and self._final_report["answered"] == answered:
+                return self._final_report
+            summary = self.report_summary
+            correct = self.correct_count
+            weak_topics = list(self.weak_topics)
+            missing = self.answers_with_feedbacks[self.summarized_count:answered]
+
+        if not missing:
+            return self.current_report()
+
+        polished = self.generator.generate_report(
+            [a["question"] for a in missing],
+            [a["user_answer"] for a in missing],
+            [a["feedback"] for a in missing],
+            summary=summary,
+            markdown_text=self.concatenated_docs,
+        )
+        for topic in polished.weak_topics:
+            if topic not in weak_topics:
+                weak_topics.append(topic)
+        report = SessionReport(
+            summary=polished.report,
+            correct=correct + min(max(polished.correct, 0), len(missing)),
+            answered=answered,
+            weak_topics=weak_topics,
+            stale=False,
         )
+        with self._summary_lock:
+            self._final_report = report
+        return report
@@ -0,0 +1,122 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+from quiz_generator import QuizGenerator
+
+# Above this estimated size the raw pages are replaced by a digest in prompts
+DIGEST_TOKEN_BUDGET = int(os.getenv("DIGEST_TOKEN_BUDGET", "8000"))
+DIGEST_MAX_WORKERS = int(os.getenv("DIGEST_MAX_WORKERS", "4"))
+
+DIGEST_CACHE_SIZE = int(os.getenv("DIGEST_CACHE_SIZE", "256"))
+PAGE_SUMMARY_CACHE_SIZE = int(os.getenv("PAGE_SUMMARY_CACHE_SIZE", "4096"))
+
+# Shared by every session, least recently used evicted first:
+# page summaries by page text hash, digests by document set
+_page_summaries: "OrderedDict[str, Future]" = OrderedDict()
+_digests: "OrderedDict[str, Future]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cached(cache: "OrderedDict[str, Future]", key: str, max_entries: int, compute: Callable[[], str]) -> str:
+    """
+    Get `key` from `cache` or compute it. Concurrent callers with the same key
+    wait for the first computation instead of repeating it.
+    """
+    with _cache_lock:
+        future = cache.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            cache[key] = future
+            while len(cache) > max_entries:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+
+    if not owner:
+        return future.result()
+
+    try:
+        future.set_result(compute())
+    except Exception as e:
+        # Forget the failed attempt so the next caller retries
+        with _cache_lock:
+            if cache.get(key) is future:
+                del cache[key]
+        future.set_exception(e)
+    return future.result()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count, about four characters per token"""
+    return len(text) // 4
+
+
+def concatenate_pages(pages: list[str]) -> str:
+    """Join OCR pages into the raw text used in prompts"""
+    concatenated = ""
+    for i, page in enumerate(pages):
+        concatenated += f"""
+Page {i + 1}:
+{page}
+
+"""
+    return concatenated
+
+
+def digest_key(pages: list[str]) -> str:
+    """Identify a document set by the hash of its pages, in order"""
+    sha = hashlib.sha256()
+    for page in pages:
+        sha.update(page.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def page_key(page: str) -> str:
+    return hashlib.sha256(page.encode("utf-8")).hexdigest()
+
+
+def build_digest(generator: QuizGenerator, pages: list[str]) -> str:
+    """
+    Summarize every page in parallel (map) and merge the summaries into one
+    study digest (reduce). Page summaries are cached by page content, so when
+    pages are added to a set only the new pages are summarized again; the merge
+    is cached by document set.
+
+    Args:
+        generator (QuizGenerator): Generator used for the summarization calls
+        pages (list[str]): OCR text of each page
+
+    Returns:
+        str: The study digest
+    """
+    def summarize(page: str, page_number: int) -> str:
+        return _cached(
+            _page_summaries, page_key(page), PAGE_SUMMARY_CACHE_SIZE,
+            lambda: generator.summarize_page(page, page_number)
+        )
+
+    def merge() -> str:
+        print(f"📚 Building study digest for {len(pages)} pages")
+        with ThreadPoolExecutor(max_workers=DIGEST_MAX_WORKERS) as executor:
+            summaries = list(executor.map(summarize, pages, range(1, len(pages) + 1)))
+        digest = generator.merge_page_summaries(summaries)
+        print(f"✨ Study digest ready: {len(digest)} characters")
+        return digest
+
+    return _cached(_digests, digest_key(pages), DIGEST_CACHE_SIZE, merge)
+
+
+def study_context(generator: QuizGenerator, pages: list[str], token_budget: int = DIGEST_TOKEN_BUDGET) -> str:
+    """
+    Text to put in prompts for a set of pages: the raw pages while they fit in
+    `token_budget`, the study digest once they do not.
+    """
+    concatenated = concatenate_pages(pages)
+    if estimate_tokens(concatenated) <= token_budget:
+        return concatenated
+    return build_digest(generator, pages)
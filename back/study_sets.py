@@ -0,0 +1,161 @@
+import os
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from quiz_generator import QuizGenerator
+from tts import SpeechSynthesizer
+from sessions import Session, Question, PAGE_WAIT_TIMEOUT_SECONDS
+
+STUDY_SET_INGEST_WORKERS = int(os.getenv("STUDY_SET_INGEST_WORKERS", "4"))
+
+
+class StudySet(object):
+    """
+    A document set ingested once and shared, read-only, by every session attached
+    to it: OCR text, prompt context (raw pages or digest) and question bank.
+    Kept alive while any creator or session holds a reference.
+    """
+    id: str
+    pages: tuple[str, ...]
+    context: str
+    questions: tuple[Question, ...]
+    refcount: int
+    error: Optional[str]
+
+    def __init__(self, id: str, page_count: int):
+        self.id = id
+        self.page_count = page_count
+        self.pages = ()
+        self.context = ""
+        self.questions = ()
+        self.refcount = 0
+        self.error = None
+        # One token per creator reference, each releases it once
+        self._release_tokens: set[str] = set()
+        self._ready = threading.Event()
+
+    @property
+    def status(self) -> str:
+        if not self._ready.is_set():
+            return "ingesting"
+        return "failed" if self.error else "ready"
+
+    def wait_ready(self, timeout: float = PAGE_WAIT_TIMEOUT_SECONDS):
+        """Block until ingestion finished, raise ValueError if it failed or timed out"""
+        if not self._ready.wait(timeout):
+            raise ValueError(f"Study set {self.id} is still being ingested. Please try again.")
+        if self.error:
+            raise ValueError(f"Study set {self.id} could not be ingested: {self.error}")
+
+    def ingest(self, generator: QuizGenerator, synthesizer: Optional[SpeechSynthesizer], base64_docs: list[str]):
+        """
+        Run the regular session pipeline once (archive, near-duplicate check, OCR,
+        digest, question generation, audio pre-synthesis), pages in parallel, then
+        keep only its results. The images are not retained. Pages that fail are
+        left out, as in a session upload; the set fails only if none is read.
+        """
+        try:
+            builder = Session(generator, synthesizer)
+            slots = builder.reserve_pages(base64_docs)
+            with ThreadPoolExecutor(max_workers=STUDY_SET_INGEST_WORKERS) as executor:
+                list(executor.map(lambda slot, doc: self._ingest_page(builder, slot, doc), slots, base64_docs))
+            if not builder.decoded_docs:
+                raise ValueError("None of the pages could be read")
+            builder.generate_next_question()
+
+            self.pages = tuple(builder.decoded_docs)
+            self.context = builder.concatenated_docs
+            self.questions = tuple(builder.questions_to_ask)
+            print(f"✨ Study set {self.id} ready: {len(self.pages)} pages, {len(self.questions)} questions")
+        except Exception as e:
+            print(f"❌ Failed to ingest study set {self.id}: {str(e)}")
+            self.error = str(e)
+        finally:
+            self._ready.set()
+
+
+    def _ingest_page(self, builder: Session, slot: int, base64_doc: str):
+        try:
+            builder.ingest_page(slot, base64_doc)
+        except Exception as e:
+            print(f"❌ Failed to ingest image {slot + 1} of study set {self.id}: {str(e)}")
+
+
+class StudySetRegistry(object):
+    """
+    Study sets by id. Uploading the same images again returns the existing set
+    instead of ingesting them a second time.
+    """
+
+    def __init__(self):
+        self._sets: dict[str, StudySet] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="study-set")
+
+    @staticmethod
+    def content_id(base64_docs: list[str]) -> str:
+        sha = hashlib.sha256()
+        for doc in base64_docs:
+            sha.update(doc.encode("ascii", errors="ignore"))
+            sha.update(b"\0")
+        return sha.hexdigest()[:16]
+
+    def create(self,
+               generator: QuizGenerator,
+               synthesizer: Optional[SpeechSynthesizer],
+               base64_docs: list[str]) -> tuple[StudySet, str]:
+        """
+        Get or start ingesting the study set of these images. The caller holds a
+        reference on the returned set until it calls release_creator() with the
+        returned release token.
+        """
+        set_id = self.content_id(base64_docs)
+        with self._lock:
+            study_set = self._sets.get(set_id)
+            # A failed ingestion is retried rather than handed out again
+            created = study_set is None or study_set.status == "failed"
+            if created:
+                study_set = StudySet(set_id, len(base64_docs))
+                self._sets[set_id] = study_set
+            release_token = uuid.uuid4().hex
+            study_set._release_tokens.add(release_token)
+            study_set.refcount += 1
+
+        if created:
+            print(f"📚 Ingesting study set {set_id} from {len(base64_docs)} images")
+            self._executor.submit(study_set.ingest, generator, synthesizer, base64_docs)
+        return study_set, release_token
+
+    def get(self, set_id: str) -> Optional[StudySet]:
+        with self._lock:
+            return self._sets.get(set_id)
+
+    def acquire(self, set_id: str) -> Optional[StudySet]:
+        """Take a reference on an existing set, None if there is no such set"""
+        with self._lock:
+            study_set = self._sets.get(set_id)
+            if study_set is not None:
+                study_set.refcount += 1
+            return study_set
+
+    def release(self, study_set: StudySet):
+        """Drop a reference, the set is forgotten once nobody holds one"""
+        with self._lock:
+            self._drop_reference(study_set)
+
+    def release_creator(self, study_set: StudySet, release_token: str) -> bool:
+        """Drop the creator reference of `release_token`, False if it is unknown or already released"""
+        with self._lock:
+            if release_token not in study_set._release_tokens:
+                return False
+            study_set._release_tokens.discard(release_token)
+            self._drop_reference(study_set)
+            return True
+
+    def _drop_reference(self, study_set: StudySet):
+        study_set.refcount -= 1
+        if study_set.refcount <= 0 and self._sets.get(study_set.id) is study_set:
+            del self._sets[study_set.id]
+            print(f"🗑️  Released study set {study_set.id}")
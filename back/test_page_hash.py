@@ -0,0 +1,75 @@
+import io
+import base64
+import random
+import itertools
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+import page_hash
+
+WORDS = (
+    "the cell membrane protein energy mitochondria gradient transport osmosis "
+    "diffusion enzyme substrate active passive channel pump sodium potassium "
+    "glucose lipid bilayer water solute concentration"
+).split()
+
+
+def render_page(seed: int) -> Image.Image:
+    """A text page with the same layout as every other seed, only the words differ"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((100, 80), " ".join(rng.choices(WORDS, k=4)).title(), fill="black",
+              font=ImageFont.load_default(48))
+    body = ImageFont.load_default(26)
+    y = 200
+    for _ in range(5):
+        for _ in range(8):
+            draw.text((100, y), " ".join(rng.choices(WORDS, k=9)), fill="black", font=body)
+            y += 36
+        y += 40
+    return image
+
+
+def to_base64(image: Image.Image, format: str = "JPEG") -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format, quality=85)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+@pytest.fixture(scope="module")
+def pages():
+    return [render_page(seed) for seed in range(30)]
+
+
+def test_distinct_pages_with_the_same_layout_are_not_duplicates(pages):
+    hashes = [page_hash.image_hash(to_base64(page)) for page in pages]
+    for a, b in itertools.combinations(hashes, 2):
+        index = page_hash.PageHashIndex()
+        index.add(a, "page a")
+        assert index.find(b) is None
+
+
+def test_same_page_is_a_duplicate(pages):
+    index = page_hash.PageHashIndex()
+    index.add(page_hash.image_hash(to_base64(pages[0])), "page text")
+    assert index.find(page_hash.image_hash(to_base64(pages[0]))) == "page text"
+    assert index.find(page_hash.image_hash(to_base64(pages[1]))) is None
+
+
+def test_shared_cache_only_matches_identical_images(pages):
+    cache = page_hash.PageTextCache(max_entries=2)
+    original = to_base64(pages[0])
+    cache.add(page_hash.content_key(original), "page text")
+    assert cache.get(page_hash.content_key(original)) == "page text"
+    assert cache.get(page_hash.content_key(f"data:image/jpeg;base64,{original}")) == "page text"
+    assert cache.get(page_hash.content_key(to_base64(pages[0], "PNG"))) is None
+
+
+def test_shared_cache_evicts_least_recently_used():
+    cache = page_hash.PageTextCache(max_entries=2)
+    cache.add("a", "A")
+    cache.add("b", "B")
+    cache.get("a")
+    cache.add("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
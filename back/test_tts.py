@@ -0,0 +1,137 @@
+import threading
+import pytest
+import tts
+from sessions import Session
+
+
+class CountingProvider(tts.LocalProvider):
+    """LocalProvider that counts calls and can be held back until released"""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def synthesize(self, text, voice):
+        self.calls.append((text, voice))
+        self.release.wait(5)
+        yield from super().synthesize(text, voice)
+
+
+class FailingProvider(tts.TTSProvider):
+    def synthesize(self, text, voice):
+        raise RuntimeError("provider down")
+        yield b""
+
+
+class FakeGenerator:
+    def generate_questions(self, markdown_text, num_questions):
+        return ["What is a cell?", "What is DNA?"], ["A unit of life", "Genetic material"]
+
+
+def test_provider_must_implement_synthesize():
+    with pytest.raises(TypeError):
+        tts.TTSProvider()
+
+
+def test_stream_caches_audio_per_text_and_voice():
+    provider = CountingProvider()
+    synthesizer = tts.SpeechSynthesizer(provider)
+
+    first = b"".join(synthesizer.stream("hello", "voice-a"))
+    second = b"".join(synthesizer.stream("hello", "voice-a"))
+    other_voice = b"".join(synthesizer.stream("hello", "voice-b"))
+
+    assert first == second
+    assert first.startswith(b"RIFF")
+    assert first != other_voice
+    assert provider.calls == [("hello", "voice-a"), ("hello", "voice-b")]
+
+
+def test_cache_evicts_least_recently_used():
+    cache = tts.AudioCache(max_bytes=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.get("a")
+    cache.put("c", b"12345")
+
+    assert cache.get("a") == b"12345"
+    assert cache.get("b") is None
+    assert cache.total_bytes == 10
+
+
+def test_concurrent_requests_share_one_synthesis():
+    provider = CountingProvider()
+    provider.release.clear()
+    synthesizer = tts.SpeechSynthesizer(provider)
+    results = []
+
+    threads = [
+        threading.Thread(target=lambda: results.append(b"".join(synthesizer.stream("hello"))))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    provider.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(provider.calls) == 1
+    assert len(results) == 3 and len(set(results)) == 1
+
+
+def test_presynthesize_fills_the_cache():
+    provider = CountingProvider()
+    synthesizer = tts.SpeechSynthesizer(provider)
+
+    synthesizer.presynthesize(["one", "two", "one"])
+    audio = b"".join(synthesizer.stream("two"))
+
+    assert audio.startswith(b"RIFF")
+    assert sorted(text for text, _ in provider.calls) == ["one", "two"]
+
+
+def test_interrupted_stream_does_not_block_later_requests():
+    synthesizer = tts.SpeechSynthesizer(CountingProvider())
+
+    stream = synthesizer.stream("hello")
+    next(stream)
+    stream.close()
+
+    assert b"".join(synthesizer.stream("hello")).startswith(b"RIFF")
+
+
+def test_failed_synthesis_is_not_cached():
+    synthesizer = tts.SpeechSynthesizer(FailingProvider())
+
+    with pytest.raises(RuntimeError):
+        b"".join(synthesizer.stream("hello"))
+    with pytest.raises(RuntimeError):
+        b"".join(synthesizer.stream("hello"))
+
+
+def test_session_presynthesizes_generated_questions():
+    provider = CountingProvider()
+    provider.release.clear()
+    synthesizer = tts.SpeechSynthesizer(provider)
+    session = Session(FakeGenerator(), synthesizer)
+
+    assert session.generate_next_question() == "What is a cell?"
+    provider.release.set()
+    audio = b"".join(synthesizer.stream(session.current_question_text()))
+
+    assert audio.startswith(b"RIFF")
+    assert sorted(text for text, _ in provider.calls) == ["What is DNA?", "What is a cell?"]
+
+
+def test_create_synthesizer_needs_an_explicit_provider(monkeypatch):
+    monkeypatch.delenv("ELEVENLABS_API_KEY", raising=False)
+    monkeypatch.delenv("TTS_PROVIDER", raising=False)
+    assert tts.create_synthesizer() is None
+
+    monkeypatch.setenv("TTS_PROVIDER", "elevenlabs")
+    with pytest.raises(ValueError):
+        tts.create_synthesizer()
+
+    monkeypatch.setenv("TTS_PROVIDER", "local")
+    assert isinstance(tts.create_synthesizer().provider, tts.LocalProvider)
@@ -0,0 +1,212 @@
+import io
+import os
+import math
+import wave
+import struct
+import hashlib
+import threading
+import requests
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, Optional
+
+# "Jessica", the voice the front end uses
+DEFAULT_VOICE = os.getenv("TTS_VOICE_ID", "g6xIsTj2HwM6VR4iXFCw")
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+AUDIO_CHUNK_SIZE = 16 * 1024
+
+
+class TTSProvider(ABC):
+    """Turns text into audio, yielded as chunks while it is produced"""
+    media_type: str = "audio/mpeg"
+
+    @abstractmethod
+    def synthesize(self, text: str, voice: str) -> Iterator[bytes]:
+        ...
+
+
+class ElevenLabsProvider(TTSProvider):
+    media_type = "audio/mpeg"
+
+    def __init__(self, api_key: str, model_id: str = "eleven_multilingual_v2"):
+        if not api_key:
+            raise ValueError("ElevenLabsProvider requires an API key")
+        self.api_key = api_key
+        self.model_id = model_id
+
+    def synthesize(self, text: str, voice: str) -> Iterator[bytes]:
+        response = requests.post(
+            f"https://api.elevenlabs.io/v1/text-to-speech/{voice}/stream",
+            headers={"xi-api-key": self.api_key, "Accept": self.media_type},
+            json={"text": text, "model_id": self.model_id},
+            stream=True,
+            timeout=30,
+        )
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=AUDIO_CHUNK_SIZE):
+            if chunk:
+                yield chunk
+
+
+class LocalProvider(TTSProvider):
+    """
+    Offline stand-in for tests and development without an ElevenLabs key.
+    Produces a WAV tone whose length grows with the text, deterministic per text and voice.
+    """
+    media_type = "audio/wav"
+    sample_rate = 16000
+
+    def synthesize(self, text: str, voice: str) -> Iterator[bytes]:
+        duration = min(0.05 * len(text), 10.0)
+        frequency = 220 + int(hashlib.sha256(voice.encode()).hexdigest()[:2], 16)
+        frames = b"".join(
+            struct.pack("<h", int(8000 * math.sin(2 * math.pi * frequency * i / self.sample_rate)))
+            for i in range(int(duration * self.sample_rate))
+        )
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(frames)
+        audio = buffer.getvalue()
+        for start in range(0, len(audio), AUDIO_CHUNK_SIZE):
+            yield audio[start:start + AUDIO_CHUNK_SIZE]
+
+
+class AudioCache(object):
+    """Synthesized audio keyed on text and voice, least recently used evicted first"""
+
+    def __init__(self, max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str, voice: str) -> str:
+        return hashlib.sha256(f"{voice}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+            return audio
+
+    def put(self, key: str, audio: bytes):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = audio
+            self.total_bytes += len(audio)
+            while self.total_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
+class SpeechSynthesizer(object):
+    """
+    Cached text-to-speech on top of a provider. Texts can be pre-synthesized in the
+    background; a request for a text still being synthesized waits for that work
+    instead of starting it again.
+    """
+
+    def __init__(self, provider: TTSProvider, cache: Optional[AudioCache] = None, max_workers: int = 2):
+        self.provider = provider
+        self.cache = cache if cache is not None else AudioCache()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def media_type(self) -> str:
+        return self.provider.media_type
+
+    def stream(self, text: str, voice: Optional[str] = None) -> Iterator[bytes]:
+        """Yield the audio of `text` in chunks, from the cache when possible"""
+        voice = voice or DEFAULT_VOICE
+        key = AudioCache.key(text, voice)
+        audio = self.cache.get(key)
+        if audio is None:
+            with self._lock:
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._inflight[key] = future
+            if owner:
+                # Nobody is synthesizing this text yet: forward chunks as they arrive
+                yield from self._synthesize(text, voice, key, future)
+                return
+            audio = future.result()
+
+        for start in range(0, len(audio), AUDIO_CHUNK_SIZE):
+            yield audio[start:start + AUDIO_CHUNK_SIZE]
+
+    def presynthesize(self, texts: list[str], voice: Optional[str] = None):
+        """Synthesize texts in the background so later requests hit the cache"""
+        voice = voice or DEFAULT_VOICE
+        for text in texts:
+            key = AudioCache.key(text, voice)
+            if self.cache.get(key) is not None:
+                continue
+            with self._lock:
+                if key in self._inflight:
+                    continue
+                future = Future()
+                self._inflight[key] = future
+            self._executor.submit(lambda t=text, k=key, f=future: list(self._synthesize(t, voice, k, f)))
+
+    def _synthesize(self, text: str, voice: str, key: str, future: Future) -> Iterator[bytes]:
+        chunks = []
+        completed = False
+        try:
+            for chunk in self.provider.synthesize(text, voice):
+                chunks.append(chunk)
+                yield chunk
+            completed = True
+        except Exception as e:
+            print(f"❌ Speech synthesis failed: {str(e)}")
+            future.set_exception(e)
+            raise
+        finally:
+            # Cache before leaving the inflight table so no caller misses both
+            if completed:
+                audio = b"".join(chunks)
+                self.cache.put(key, audio)
+            with self._lock:
+                del self._inflight[key]
+            if completed:
+                future.set_result(audio)
+            elif not future.done():
+                # The client went away mid-stream, let waiters fail instead of hanging
+                future.set_exception(RuntimeError("Speech synthesis was interrupted"))
+
+
+def create_synthesizer() -> Optional[SpeechSynthesizer]:
+    """
+    Build the synthesizer selected by TTS_PROVIDER:
+        "elevenlabs" (default when ELEVENLABS_API_KEY is set): requires ELEVENLABS_API_KEY
+        "local": placeholder tones, for tests and offline development only
+
+    Returns:
+        Optional[SpeechSynthesizer]: None when no provider is configured, audio is then disabled
+    """
+    provider_name = os.getenv("TTS_PROVIDER")
+    api_key = os.getenv("ELEVENLABS_API_KEY")
+    if provider_name is None:
+        provider_name = "elevenlabs" if api_key else None
+
+    if provider_name is None:
+        print("Warning: ELEVENLABS_API_KEY not found in environment variables, audio endpoints are disabled")
+        return None
+    if provider_name == "elevenlabs":
+        if not api_key:
+            raise ValueError("TTS_PROVIDER=elevenlabs requires ELEVENLABS_API_KEY")
+        return SpeechSynthesizer(ElevenLabsProvider(api_key))
+    if provider_name == "local":
+        print("Warning: using local TTS provider, audio is a placeholder tone")
+        return SpeechSynthesizer(LocalProvider())
+    raise ValueError(f"Unknown TTS_PROVIDER: {provider_name}")
@@ -3,11 +3,48 @@
 Script to show the location of the temporary folder where images will be saved
 """
 import os
+import sys
 import tempfile
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "back"))
+import image_archive
+
+
+def format_bytes(size: float) -> str:
+    """Human readable byte count"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_age(seconds: float) -> str:
+    """Human readable age"""
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+def show_usage_stats(temp_dir: str):
+    """Show archive usage against the retention limits"""
+    stats = image_archive.usage_stats(temp_dir)
+    used_pct = 100 * stats["total_bytes"] / stats["max_bytes"] if stats["max_bytes"] else 0
+
+    print(f"\n📊 Usage statistics:")
+    print(f"   Files: {stats['files']}")
+    print(f"   Total size: {format_bytes(stats['total_bytes'])} "
+          f"of {format_bytes(stats['max_bytes'])} ({used_pct:.1f}%)")
+    if stats["files"]:
+        print(f"   Oldest file: {format_age(stats['oldest_age_seconds'])} ago")
+        print(f"   Newest file: {format_age(stats['newest_age_seconds'])} ago")
+    print(f"   Retention: files older than {format_age(stats['max_age_seconds'])} are evicted")
+
+
 def show_temp_folder():
     """Show the temp folder location"""
-    temp_dir = os.path.join(tempfile.gettempdir(), "quiz_images")
+    temp_dir = image_archive.ARCHIVE_DIR
 
     print("🗂️  Image Storage Information:")
     print(f"   Temp folder location: {temp_dir}")
@@ -18,15 +55,15 @@ def show_temp_folder():
         print(f"   ✅ Folder exists")
 
         # List existing files
-        files = os.listdir(temp_dir)
+        files = image_archive.archived_files(temp_dir)
         if files:
             print(f"   📁 Contains {len(files)} files:")
-            for file in sorted(files):
-                filepath = os.path.join(temp_dir, file)
-                size = os.path.getsize(filepath)
-                print(f"      - {file} ({size} bytes)")
+            for entry in sorted(files, key=lambda entry: entry.name):
+                print(f"      - {entry.name} ({entry.stat().st_size} bytes)")
         else:
             print(f"   📂 Folder is empty")
+
+        show_usage_stats(temp_dir)
     else:
         print(f"   📁 Folder will be created when first image is uploaded")
 
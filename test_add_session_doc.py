@@ -4,6 +4,7 @@ Test script for the add_session_doc endpoint
 """
 import requests
 import json
+import time
 import base64
 
 # Base URL for the API
@@ -51,14 +52,23 @@ def test_add_session_doc():
         headers={"Content-Type": "application/json"}
     )
 
-    if doc_response.status_code == 200:
+    if doc_response.status_code == 202:
         result = doc_response.json()
-        print(f"   ✅ Successfully added documents: {result}")
+        print(f"   ✅ Ingest job started: {result['job_id']}")
     else:
         print(f"   ❌ Failed to add documents: {doc_response.status_code}")
         print(f"   Error: {doc_response.text}")
         return
 
+    # Poll the ingest job until every page has been processed
+    print("   Waiting for ingestion to finish...")
+    job_url = f"{BASE_URL}/session/{session_id}/doc/jobs/{result['job_id']}"
+    job = requests.get(job_url).json()
+    while job["status"] == "running":
+        time.sleep(0.5)
+        job = requests.get(job_url).json()
+    print(f"   Ingest job {job['status']}: {[page['status'] for page in job['pages']]}")
+
     # Step 4: Test error cases
     print("4. Testing error cases...")
 